@@ -12,6 +12,7 @@ SOURCE_URL = "https://www.photovoltaique.info/fr/tarifs-dachat-et-autoconsommati
 UA = "Mozilla/5.0 (compatible; EchomePrimesBot/1.0; +https://github.com/)"
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 OUT_FILE = os.path.join(ROOT, "data", "primes.json")
+_WS_RE = re.compile(r"\s+")
 
 class TableCollector(HTMLParser):
     def __init__(self):
@@ -26,14 +27,13 @@ class TableCollector(HTMLParser):
     def handle_endtag(self, tag):
         if tag.lower() == "table" and self.in_table:
             self.in_table = False
+            # normalisation des blancs une seule fois par tableau
             text = " ".join(self.current)
-            self.tables.append(re.sub(r"\s+", " ", text).strip())
+            self.tables.append(_WS_RE.sub(" ", text).strip())
             self.current = []
     def handle_data(self, data):
         if self.in_table:
-            t = data.strip()
-            if t:
-                self.current.append(t)
+            self.current.append(data)
 
 def fetch(url: str) -> str:
     req = Request(url, headers={"User-Agent": UA})
@@ -5,110 +5,269 @@ scripts/scrape_tarifs.py
 Scrape les tarifs photovoltaïques (surplus EDF OA) depuis photovoltaique.info
 et met à jour data/tarifs.json au format consommé par assets/tarifs.js.
 
-- Stdlib only (urllib, html.parser, re, json)
+- Stdlib only (http.client, html, re, json) ; selectolax (parsing HTML) et
+  orjson (écriture JSON) sont utilisés s'ils sont installés, sans être requis
 - Heuristique : recherche de lignes contenant kWc et €/kWh
 - Tolérant aux changements mineurs de mise en page
 
 Exécution locale :
-  python scripts/scrape_tarifs.py
+  python scripts/scrape_tarifs.py            # saute le travail si rien n'a changé
+  python scripts/scrape_tarifs.py --force    # ignore le cache et réécrit tarifs.json
+  python -m doctest scripts/scrape_tarifs.py # vérifie l'extraction sur des exemples
 """
 
 from __future__ import annotations
-import os, sys, json, re, datetime
-from urllib.request import urlopen, Request
-from html.parser import HTMLParser
+import os, sys, json, re, datetime, hashlib, gzip
+from collections.abc import Iterator
+from html import unescape
+from http.client import HTTPConnection, HTTPSConnection
+from urllib.parse import urljoin, urlsplit
+
+try:  # optionnel : parseur HTML en C (lexbor)
+    from selectolax.parser import HTMLParser as FastHTML
+except ImportError:
+    FastHTML = None
+
+try:  # optionnel : encodeur JSON en C
+    import orjson
+except ImportError:
+    orjson = None
 
 SOURCE_URL = "https://www.photovoltaique.info/fr/tarifs-dachat-et-autoconsommation/"
 UA = "Mozilla/5.0 (compatible; EchomeTarifsBot/1.0; +https://github.com/)"
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 OUT_FILE = os.path.join(ROOT, "data", "tarifs.json")
+# ETag / Last-Modified / SHA-256 de la dernière réponse : évite de re-parser
+# (et de réécrire tarifs.json) quand la page source n'a pas bougé.
+CACHE_FILE = os.path.join(ROOT, "data", ".tarifs.cache.json")
 
 # --------- HTML parsing minimaliste (récupération brute des <table>) ---------
-class TableCollector(HTMLParser):
-    def __init__(self):
-        super().__init__()
-        self.in_table = False
-        self.current = []
-        self.tables = []
-
-    def handle_starttag(self, tag, attrs):
-        if tag.lower() == "table":
-            self.in_table = True
-            self.current = []
-
-    def handle_endtag(self, tag):
-        if tag.lower() == "table" and self.in_table:
-            self.in_table = False
-            text = " ".join(self.current)
-            # Normaliser les espaces
-            text = re.sub(r"\s+", " ", text).strip()
-            if text:
-                self.tables.append(text)
-            self.current = []
-
-    def handle_data(self, data):
-        if self.in_table:
-            t = data.strip()
-            if t:
-                self.current.append(t)
-
-def fetch(url: str) -> str:
-    req = Request(url, headers={"User-Agent": UA})
-    with urlopen(req, timeout=30) as r:
-        return r.read().decode("utf-8", errors="ignore")
+# Regex compilées une seule fois : l'extraction des <table> et le nettoyage des
+# balises tournent dans le moteur C de `re` au lieu de callbacks Python.
+# Le scan des <table> se fait directement sur les octets de la réponse : seuls
+# les corps de tableaux capturés sont décodés.
+_TABLE_RE = re.compile(rb"<table\b[^>]*>(.*?)</table>", re.IGNORECASE | re.DOTALL)
+# balises et blancs consécutifs fusionnés en un seul espace, en une passe.
+# Seul un "<" suivi d'une lettre, "/", "!" ou "?" ouvre une balise (comme pour
+# HTMLParser) : un "< 3 kWc" nu reste du texte.
+_TAG_WS_RE = re.compile(r"(?:<[A-Za-z/!?][^>]*>|\s)+")
+_WS_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+")
+
+# Les tarifs sont dans les premiers tableaux de la page : inutile de parcourir
+# le reste du document.
+MAX_TABLES = 10
+
+def extract_tables(raw: bytes, limit: int = MAX_TABLES) -> Iterator[str]:
+    """Texte brut (balises retirées, espaces normalisés) des premiers <table>.
+
+    Générateur : l'appelant peut s'arrêter dès qu'il a ce qu'il cherche.
+    """
+    if FastHTML is not None:
+        yield from _extract_tables_fast(raw, limit)
+        return
+    for i, m in enumerate(_TABLE_RE.finditer(raw)):
+        if i >= limit:
+            break
+        text = _TAG_WS_RE.sub(" ", m.group(1).decode("utf-8", errors="ignore"))
+        if "&" in text:
+            # les entités (&nbsp; …) peuvent réintroduire des blancs
+            text = _WS_RE.sub(" ", unescape(text))
+        text = text.strip()
+        if text:
+            yield text
+
+def _extract_tables_fast(raw: bytes, limit: int) -> Iterator[str]:
+    for tbl in FastHTML(raw.decode("utf-8", errors="ignore")).css("table")[:limit]:
+        text = _WS_RE.sub(" ", tbl.text(separator=" ")).strip()
+        if text:
+            yield text
+
+def load_cache() -> dict:
+    try:
+        with open(CACHE_FILE, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_cache(cache: dict) -> None:
+    with open(CACHE_FILE, "w", encoding="utf-8") as f:
+        json.dump(cache, f, indent=2)
+
+# Connexion HTTPS persistante : les requêtes suivantes (redirections, autres
+# pages du même site) réutilisent la session TCP+TLS. Fermée à la fin de main().
+conn = HTTPSConnection(urlsplit(SOURCE_URL).hostname, timeout=30)
+MAX_REDIRECTS = 5
+
+def fetch(url: str, cache: dict) -> bytes | None:
+    """GET conditionnel ; None si le serveur répond 304 (page inchangée).
+
+    `cache` est mis à jour avec l'ETag / Last-Modified de la réponse.
+    """
+    # réponse compressée : ~5x moins d'octets à transférer pour une page HTML
+    headers = {"User-Agent": UA, "Accept-Encoding": "gzip"}
+    if cache.get("etag"):
+        headers["If-None-Match"] = cache["etag"]
+    if cache.get("last_modified"):
+        headers["If-Modified-Since"] = cache["last_modified"]
+    for _ in range(MAX_REDIRECTS + 1):
+        parts = urlsplit(url)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        if parts.scheme == "https" and parts.hostname == conn.host:
+            conn.request("GET", path, headers=headers)
+            resp = conn.getresponse()
+            body = resp.read()  # toujours lire la réponse pour libérer la connexion
+        else:
+            # redirection vers un autre hôte (apex, CDN …) : connexion ponctuelle
+            cls = HTTPConnection if parts.scheme == "http" else HTTPSConnection
+            other = cls(parts.hostname, parts.port, timeout=30)
+            try:
+                other.request("GET", path, headers=headers)
+                resp = other.getresponse()
+                body = resp.read()
+            finally:
+                other.close()
+        if resp.status == 304:
+            return None
+        if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+            url = urljoin(url, resp.getheader("Location"))
+            continue
+        if resp.status != 200:
+            raise RuntimeError(f"HTTP {resp.status} {resp.reason}: {url}")
+        cache["etag"] = resp.getheader("ETag")
+        cache["last_modified"] = resp.getheader("Last-Modified")
+        if (resp.getheader("Content-Encoding") or "").lower() == "gzip":
+            body = gzip.decompress(body)
+        return body
+    raise RuntimeError(f"trop de redirections: {url}")
 
 # --------- Extraction heuristique des lignes "plage kWc" + "€/kWh" ----------
-ROW_REGEX = re.compile(
-    r"(?P<range>(?:≤|<)?\s*\d+\s*(?:–|-|à)\s*\d+\s*kWc|≤\s*\d+\s*kWc|\d+\s*kWc)"
-    r".{0,80}?"
-    r"(?P<eur>0[,\.]\d{3,4})\s*€/?.{0,10}?kWh",
-    re.IGNORECASE
+# Recherche par positions autour de chaque repère "kWc" : la plage juste avant
+# (motif ancré en fin de fenêtre), puis le tarif et le "kWh" juste après, chacun
+# borné par `endpos`. Aucun quantificateur `.{0,n}?` paresseux, donc pas de
+# backtracking sur les longs tableaux.
+# re.ASCII : \s, \d et le repli de casse restent sur l'ASCII (pas de tables
+# Unicode). Sans risque ici, les blancs Unicode (&nbsp; …) étant déjà
+# normalisés en " " par extract_tables ; ≤, –, à et € sont des littéraux.
+_KWC_RE = re.compile(r"kWc", re.IGNORECASE | re.ASCII)
+_RANGE_RE = re.compile(
+    r"(?P<range>(?:≤|<)?\s*\d+\s*(?:–|-|à)\s*\d+\s*|≤\s*\d+\s*|\d+\s*)$",
+    re.ASCII,
 )
+_EUR_RE = re.compile(r"(?P<eur>0[,\.]\d{3,4})\s*€/?", re.ASCII)
+_KWH_RE = re.compile(r"kWh", re.IGNORECASE | re.ASCII)
+RANGE_WINDOW = 40   # longueur max. d'une plage avant "kWc"
+EUR_WINDOW = 80     # distance max. entre "kWc" et le tarif
+KWH_WINDOW = 10     # distance max. entre "€/" et "kWh" ("€/kWh", "€ HT / kWh" …)
 
-def parse_tariffs_from_html(html: str) -> list[tuple[str, float]]:
-    parser = TableCollector()
-    parser.feed(html)
-    rows = []
-    for t in parser.tables:
-        for m in ROW_REGEX.finditer(t):
-            rang = re.sub(r"\s+", " ", m.group("range")).strip()
-            eur = m.group("eur").replace(",", ".")
-            try:
-                val = float(eur)
-                rows.append((rang, val))
-            except ValueError:
-                pass
-    # dédupliquer en gardant l’ordre
-    seen = set()
-    uniq = []
-    for r in rows:
-        if r not in seen:
-            uniq.append(r)
-            seen.add(r)
-    return uniq
+def _find_eur(t: str, start: int) -> tuple[re.Match, int] | None:
+    """Premier tarif "0,xxxx €/" commençant à ≤ EUR_WINDOW de `start` et suivi
+    de "kWh" à ≤ KWH_WINDOW caractères ; renvoie aussi la fin du "kWh"."""
+    limit = start + EUR_WINDOW
+    for e in _EUR_RE.finditer(t, start, limit + 16):
+        if e.start() > limit:
+            break
+        h = _KWH_RE.search(t, e.end(), e.end() + KWH_WINDOW + 3)
+        if h:
+            return e, h.end()
+    return None
 
-# --------- Construction du payload attendu par le front ----------------------
+# --------- Plages attendues par le front ------------------------------------
 DEFAULT_ROWS = [
     ("≤ 9 kWc", 0.040, "particuliers", 1000),
     ("9–36 kWc", 0.040, "petites pros", 5000),
     ("36–100 kWc", 0.0886, "PME/PMI", 20000),
 ]
 
-def build_payload(extracted: list[tuple[str, float]]) -> dict:
-    def _match(label_start: str) -> float | None:
-        # on matche sur le premier nombre de la plage, ex: "≤ 9" → "9"
-        token = re.findall(r"\d+", label_start)
-        if not token:
-            return None
-        first = token[0]
-        for rng, val in extracted:
-            if re.search(rf"\b{re.escape(first)}\b", rng):
-                return val
-        return None
+def _first_number(label: str) -> str | None:
+    # premier nombre de la plage, ex: "≤ 9 kWc" → "9"
+    m = _DIGITS_RE.search(label)
+    return m.group() if m else None
+
+# nombres recherchés dans les plages extraites, ex: ("9", "36")
+WANTED_FIRSTS = tuple(dict.fromkeys(
+    f for f in (_first_number(label) for label, *_ in DEFAULT_ROWS) if f
+))
+
+def parse_tariffs_from_html(
+    raw: bytes, wanted_firsts: tuple[str, ...] = WANTED_FIRSTS
+) -> dict[str, float]:
+    """Tarif (€/kWh) par nombre recherché, ex: {"9": 0.04, "36": 0.0886}.
+
+    La première plage extraite qui contient le nombre l'emporte ; le parcours
+    s'arrête dès que tous les nombres de `wanted_firsts` sont trouvés.
+
+    Comme un `finditer`, les correspondances ne se chevauchent pas : le texte
+    de la plage jusqu'au "kWh" est consommé, si bien qu'un tarif n'est attribué
+    qu'à une seule plage. Tableau en colonnes (plages en en-tête) :
+
+    >>> parse_tariffs_from_html(
+    ...     "<table><tr><th>≤ 9 kWc</th><th>9-36 kWc</th><th>36-100 kWc</th></tr>"
+    ...     "<tr><td>Tarif</td><td>0,0400 €/kWh</td><td>0,0400 €/kWh</td>"
+    ...     "<td>0,0886 €/kWh</td></tr></table>".encode())
+    {'9': 0.04}
+    >>> parse_tariffs_from_html(
+    ...     "<table><tr><td>9 kWc</td><td>36 kWc</td>"
+    ...     "<td>0,0500 €/kWh</td></tr></table>".encode())
+    {'9': 0.05}
+
+    Un "<" nu fait partie de la plage, ce n'est pas une balise :
+
+    >>> parse_tariffs_from_html(
+    ...     "<table><tr><td>< 3 kWc</td><td>0,0400 €/kWh</td></tr></table>".encode(),
+    ...     wanted_firsts=("3",))
+    {'3': 0.04}
+
+    Un prix sans "kWh" proche (ici "0,0400 €" seul) n'est pas un tarif :
 
+    >>> parse_tariffs_from_html(
+    ...     "<table><tr><td>≤ 9 kWc</td><td>0,0400 €</td><td>—</td>"
+    ...     "<td>0,1300€/kWh</td></tr></table>".encode())
+    {'9': 0.13}
+
+    Le tarif est cherché sur EUR_WINDOW caractères après la plage, quel que
+    soit le nombre de repères "kWc" intermédiaires :
+
+    >>> parse_tariffs_from_html(
+    ...     "<table><tr><th>≤ 3 kWc</th><th>3-9 kWc</th><th>9-36 kWc</th>"
+    ...     "<th>36-100 kWc</th></tr><tr><td>Tarif</td><td>0,1000 €/kWh</td>"
+    ...     "</tr></table>".encode(), wanted_firsts=("3", "9"))
+    {'3': 0.1}
+    """
+    found: dict[str, float] = {}
+    for t in extract_tables(raw):
+        # pré-filtre littéral (recherche C) : pas de "€", pas de tarif possible
+        if "€" not in t:
+            continue
+        last_end = 0    # fin du dernier "kWh" accepté
+        for k in _KWC_RE.finditer(t):
+            if k.start() < last_end:
+                continue
+            m = _RANGE_RE.search(
+                t, max(last_end, k.start() - RANGE_WINDOW), k.start()
+            )
+            if not m:
+                continue
+            hit = _find_eur(t, k.end())
+            if not hit:
+                continue
+            e, last_end = hit
+            try:
+                val = float(e.group("eur").replace(",", "."))
+            except ValueError:
+                continue
+            for tok in _DIGITS_RE.findall(m.group("range")):
+                if tok in wanted_firsts and tok not in found:
+                    found[tok] = val
+            if len(found) == len(wanted_firsts):
+                return found
+    return found
+
+# --------- Construction du payload attendu par le front ----------------------
+def build_payload(found: dict[str, float]) -> dict:
     edf_oa_surplus = []
     for label, fallback_val, seg, ex_kwh in DEFAULT_ROWS:
-        val = _match(label) or fallback_val
+        val = found.get(_first_number(label)) or fallback_val
         edf_oa_surplus.append(
             {
                 "range": label,
@@ -131,16 +290,47 @@ def build_payload(extracted: list[tuple[str, float]]) -> dict:
     }
     return payload
 
+def write_payload(payload: dict) -> None:
+    os.makedirs(os.path.dirname(OUT_FILE), exist_ok=True)
+    if orjson is not None:
+        with open(OUT_FILE, "wb") as f:
+            f.write(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+        return
+    with open(OUT_FILE, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+
 # --------- Main --------------------------------------------------------------
-def main() -> int:
+def main(argv: list[str] | None = None) -> int:
+    force = "--force" in (sys.argv[1:] if argv is None else argv)
     try:
-        html = fetch(SOURCE_URL)
-        extracted = parse_tariffs_from_html(html)
-        payload = build_payload(extracted)
+        # sans tarifs.json (ou avec --force), le cache ne sert à rien : on refait tout
+        cache = load_cache() if os.path.exists(OUT_FILE) and not force else {}
+        raw = fetch(SOURCE_URL, cache)
+        if raw is None:
+            print("Source inchangée (304), rien à faire.")
+            return 0
+        digest = hashlib.sha256(raw).hexdigest()
+        if digest == cache.get("sha256"):
+            save_cache(cache)
+            print("Source inchangée (même SHA-256), rien à faire.")
+            return 0
+
+        found = parse_tariffs_from_html(raw)
+        # la page a changé mais pas forcément les tarifs extraits
+        key = hashlib.blake2b(
+            repr(sorted(found.items())).encode(), digest_size=16
+        ).hexdigest()
+        cache["sha256"] = digest
+        if key == cache.get("extracted_key"):
+            save_cache(cache)
+            print("Tarifs extraits inchangés, tarifs.json conservé.")
+            return 0
+        payload = build_payload(found)
 
-        os.makedirs(os.path.dirname(OUT_FILE), exist_ok=True)
-        with open(OUT_FILE, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
+        write_payload(payload)
+        cache["extracted_key"] = key
+        cache["payload_mtime"] = os.path.getmtime(OUT_FILE)
+        save_cache(cache)
 
         print(f"Écrit: {OUT_FILE}")
         for r in payload["edf_oa_surplus"]:
@@ -149,6 +339,8 @@ def main() -> int:
     except Exception as e:
         print("ERREUR:", e, file=sys.stderr)
         return 1
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     raise SystemExit(main())